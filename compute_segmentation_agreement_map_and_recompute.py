@@ -6,8 +6,10 @@ a summary CSV to the outputs folder.
 """
 import os
 import sys
+from itertools import islice
 import pandas as pd
 import numpy as np
+from pandas.api.types import union_categoricals
 from sklearn.metrics import adjusted_rand_score, cohen_kappa_score
 
 ROOT = os.getcwd()
@@ -18,15 +20,22 @@ OUTDIR = os.path.join(ROOT, "outputs")
 os.makedirs(OUTDIR, exist_ok=True)
 OUT_SUM = os.path.join(OUTDIR, "segmentation_agreement_mapped.csv")
 
+# integer id columns downcast after reading so merges and sklearn inputs move fewer bytes
+ID_COLS = ('index', 'cluster', 'cluster_id')
+
 def load_csv(path):
     if not os.path.exists(path):
         print("Missing:", path)
         return None
     try:
-        return pd.read_csv(path)
+        df = pd.read_csv(path)
     except Exception as e:
         print(f"Failed to read {path}: {e}")
         return None
+    for c in ID_COLS:
+        if c in df.columns and pd.api.types.is_integer_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], downcast='integer')
+    return df
 
 df_can = load_csv(CANON)
 df_a = load_csv(PARSEA)
@@ -58,6 +67,7 @@ can_label = find_label_col(df_can)
 if can_label is None:
     sys.exit("Cannot detect canonical label column.")
 df_can = df_can.rename(columns={can_label: 'primary_label_canonical'})
+df_can['primary_label_canonical'] = df_can['primary_label_canonical'].astype('category')
 
 # prepare parse files: rename index and cluster columns
 def prepare_parse(df):
@@ -81,30 +91,43 @@ df_b = prepare_parse(df_b)
 
 # Merge canonical with parse labels
 df = df_can.copy()
+# one parse label per index; validate turns any leftover duplicate into an error instead of silently
+# multiplying canonical rows
 if df_a is not None:
-    df = df.merge(df_a[['index','cluster']].drop_duplicates(), on='index', how='left').rename(columns={'cluster':'cluster_parseA'})
+    df_a_small = df_a[['index','cluster']].drop_duplicates('index').rename(columns={'cluster':'cluster_parseA'})
+    df = df.merge(df_a_small, on='index', how='left', validate='one_to_one')
 if df_b is not None:
-    df = df.merge(df_b[['index','cluster']].drop_duplicates(), on='index', how='left').rename(columns={'cluster':'cluster_parseB'})
+    df_b_small = df_b[['index','cluster']].drop_duplicates('index').rename(columns={'cluster':'cluster_parseB'})
+    df = df.merge(df_b_small, on='index', how='left', validate='one_to_one')
 
 # Build majority-vote mapping cluster -> canonical motif
 def build_mapping(df, cluster_col):
     if cluster_col not in df.columns:
         return {}
-    mapping = {}
-    groups = df.dropna(subset=[cluster_col, 'primary_label_canonical']).groupby(cluster_col)
-    for cluster_val, g in groups:
-        top = g['primary_label_canonical'].value_counts().idxmax()
-        mapping[cluster_val] = top
-    return mapping
+    sub = df.dropna(subset=[cluster_col, 'primary_label_canonical'])
+    if sub.empty:
+        return {}
+    cluster_codes, cluster_cats = pd.factorize(sub[cluster_col], sort=True)
+    label_codes, label_cats = pd.factorize(sub['primary_label_canonical'])
+    shape = (len(cluster_cats), len(label_cats)); n = len(sub)
+    # contingency table of (cluster, label) counts
+    counts = np.zeros(shape, dtype=np.int64)
+    np.add.at(counts, (cluster_codes, label_codes), 1)
+    # row of first occurrence per pair: ties go to the label seen first within the cluster,
+    # matching the old per-group value_counts().idxmax()
+    first = np.full(shape, n, dtype=np.int64)
+    np.minimum.at(first, (cluster_codes, label_codes), np.arange(n))
+    best = np.argmax(counts * (n + 1) - first, axis=1)
+    return dict(zip(cluster_cats, label_cats[best]))
 
 map_a = build_mapping(df, 'cluster_parseA')
 map_b = build_mapping(df, 'cluster_parseB')
 
 print("ParseA mapping sample (cluster -> canonical):")
-for k,v in list(map_a.items())[:20]:
+for k,v in islice(map_a.items(), 20):
     print(k, "->", v)
 print("ParseB mapping sample (cluster -> canonical):")
-for k,v in list(map_b.items())[:20]:
+for k,v in islice(map_b.items(), 20):
     print(k, "->", v)
 
 # Apply mapping to create relabeled parse columns
@@ -134,10 +157,13 @@ def compute_agreement(col_parse):
     sub = df.dropna(subset=['primary_label_canonical', col_parse])
     if sub.empty:
         return 'NA','NA'
-    ari = adjusted_rand_score(sub['primary_label_canonical'], sub[col_parse])
-    uniq = sorted(list(set(sub['primary_label_canonical']).union(set(sub[col_parse]))))
-    mapping = {v:i for i,v in enumerate(uniq)}
-    kappa = cohen_kappa_score(sub['primary_label_canonical'].map(mapping), sub[col_parse].map(mapping))
+    # encode both columns against one shared, sorted category set so sklearn works on compact int codes
+    cats = union_categoricals([sub['primary_label_canonical'].astype('category'), sub[col_parse].astype('category')],
+                              sort_categories=True).categories
+    can_codes = pd.Categorical(sub['primary_label_canonical'], categories=cats).codes
+    parse_codes = pd.Categorical(sub[col_parse], categories=cats).codes
+    ari = adjusted_rand_score(can_codes, parse_codes)
+    kappa = cohen_kappa_score(can_codes, parse_codes)
     return ari, kappa
 
 if 'parseA_mapped' in df.columns:
@@ -154,20 +180,17 @@ else:
 
 # Per-motif preservation after mapping
 def per_motif_preservation(col_parse):
-    motifs = sorted(df['primary_label_canonical'].dropna().unique())
-    rows = []
-    for motif in motifs:
-        subset = df[df['primary_label_canonical'] == motif]
-        denom = len(subset)
-        if denom == 0:
-            frac = np.nan
-        else:
-            if col_parse in df.columns:
-                frac = (subset[col_parse] == motif).sum() / denom
-            else:
-                frac = np.nan
-        rows.append({'motif': motif, 'count_in_canonical': denom, 'fraction_preserved': frac})
-    return pd.DataFrame(rows)
+    sub = df.dropna(subset=['primary_label_canonical'])
+    if col_parse in df.columns:
+        match = sub['primary_label_canonical'] == sub[col_parse]
+    else:
+        match = pd.Series(np.nan, index=sub.index)
+    # one groupby over the whole column: size gives the canonical count, mean the preserved fraction
+    return (sub.assign(match=match)
+               .groupby('primary_label_canonical', observed=True)
+               .agg(count_in_canonical=('match', 'size'), fraction_preserved=('match', 'mean'))
+               .rename_axis('motif')
+               .reset_index())
 
 preserve_pa = per_motif_preservation('parseA_mapped') if 'parseA_mapped' in df.columns else None
 preserve_pb = per_motif_preservation('parseB_mapped') if 'parseB_mapped' in df.columns else None
@@ -0,0 +1,69 @@
+# _bootstrap.py
+# Rank-concordance bootstrap and Parquet artifact copies shared by generate_artifacts.py,
+# run_randomized_stability_tests.py and write_mapping_and_table.py
+import os
+
+import numpy as np
+
+
+def rank_min_rows(a):
+    # row-wise DataFrame.rank(axis=1, method="min") as int32, via one stable argsort:
+    # each sorted value takes the 1-based position where its run of ties starts
+    order = np.argsort(a, axis=1, kind="stable")
+    s = np.take_along_axis(a, order, axis=1)
+    pos = np.broadcast_to(np.arange(a.shape[1]), a.shape)
+    run_start = np.ones(a.shape, dtype=bool)
+    run_start[:, 1:] = s[:, 1:] != s[:, :-1]
+    first = np.maximum.accumulate(np.where(run_start, pos, 0), axis=1)
+    ranks = np.empty(a.shape, dtype=np.int32)
+    np.put_along_axis(ranks, order, (first + 1).astype(np.int32), axis=1)
+    ranks[np.isnan(a)] = 0  # 0 marks NaN, which pandas leaves unranked
+    return ranks
+
+
+def rank_concordance_bootstrap(values, n_boot=500, scale=0.05, seed=42, batch=100):
+    # fraction of values whose min-rank is unchanged under multiplicative N(1, scale) noise,
+    # one entry per replicate. Replicates are drawn batch at a time, each batch one
+    # (batch, n) noise matrix from the same generator in order, so results do not depend
+    # on batch (it only bounds memory for large n).
+    x = np.asarray(values, dtype=float)
+    # integer ranks compare directly; NaN values (rank 0) never count as concordant
+    base_ranks = rank_min_rows(x[None, :])
+    rng = np.random.default_rng(seed)
+    concord = []
+    for start in range(0, n_boot, batch):
+        noise = rng.normal(loc=1.0, scale=scale, size=(min(batch, n_boot - start), x.size))
+        pert_ranks = rank_min_rows(x[None, :] * noise)
+        concord.append(((pert_ranks == base_ranks) & (base_ranks > 0)).mean(axis=1))
+    return np.concatenate(concord) if concord else np.empty(0)
+
+
+def write_parquet_copy(df, csv_path, columns=None, chunk_rows=None):
+    # zstd Parquet copy next to a CSV artifact, for machine readers; the CSV stays the
+    # published (manifest/checksummed) file. Skipped when no Parquet engine is installed, or
+    # when a column cannot be stored (e.g. its inferred type differs between chunks), in which
+    # case any partial file is removed. With chunk_rows, the selected columns are written in
+    # slices of chunk_rows rows, so the full projection is never materialized at once.
+    pq = os.path.splitext(csv_path)[0] + ".parquet"
+    columns = list(df.columns) if columns is None else columns
+    try:
+        if chunk_rows is None or len(df) <= chunk_rows:
+            df[columns].to_parquet(pq, compression="zstd", index=False)
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as papq
+        writer = None
+        try:
+            for start in range(0, len(df), chunk_rows):
+                table = pa.Table.from_pandas(df.iloc[start:start + chunk_rows][columns], preserve_index=False)
+                if writer is None:
+                    writer = papq.ParquetWriter(pq, table.schema, compression="zstd")
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    except ImportError:
+        pass
+    except (TypeError, ValueError, OSError):
+        if os.path.exists(pq):
+            os.remove(pq)
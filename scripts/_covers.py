@@ -0,0 +1,85 @@
+# _covers.py
+# Permutation parsing and cover-violation masks shared by motif_stability_test.py and
+# order_invariant_analysis.py
+import warnings
+
+import numpy as np
+
+# canonical covers used by mapping rules
+COVERS = [
+    (1, 3), (1, 4), (1, 5),
+    (3, 8), (4, 8), (5, 6), (6, 7), (7, 8), (8, 9),
+    (9, 10), (10, 11), (11, 12)
+]
+
+
+# parse a permutation string like "6 8 3 10 ..." into an int array
+def _parse_perm(s):
+    # expects DeprecationWarning to be raised as an error (see parse_perm / parse_perms)
+    if s is None:
+        return np.empty(0, dtype=np.int64)
+    s = str(s)
+    # fast path: np.fromstring parses in C and rejects non-numeric tokens (ValueError, or a
+    # DeprecationWarning when it would otherwise truncate); it would accept signed tokens and
+    # read a blank string as [0], so those go through the token parser, which keeps digit
+    # tokens only
+    if s.strip() and "-" not in s and "+" not in s:
+        try:
+            return np.fromstring(s, dtype=np.int64, sep=" ")
+        except (DeprecationWarning, ValueError):
+            pass
+    return np.array([int(t) for t in s.split() if t.isdigit()], dtype=np.int64)
+
+
+def parse_perm(s):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        return _parse_perm(s)
+
+
+def parse_perms(perm_strs):
+    # one warnings context for the whole batch
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        return [_parse_perm(s) for s in perm_strs]
+
+
+# Covers are handled as bits of an int mask: bit i is set when COVERS[i] is violated.
+# COVERS is listed in sorted order, so ascending bit order is sorted cover order.
+COVER_BIT = {cov: 1 << i for i, cov in enumerate(COVERS)}
+
+
+def covers_to_mask(covers):
+    m = 0
+    for cov in covers:
+        m |= COVER_BIT[cov]
+    return m
+
+
+def mask_to_covers(mask):
+    return [cov for i, cov in enumerate(COVERS) if mask >> i & 1]
+
+
+FRONT_MASK = covers_to_mask([(1, 3), (1, 4), (1, 5)])
+BRE_MASK = covers_to_mask([(3, 8), (4, 8), (5, 6), (6, 7), (7, 8), (8, 9)])
+EARLY_MASK = FRONT_MASK
+LATE_MASK = covers_to_mask([(9, 10), (10, 11), (11, 12)])
+
+COVER_A = np.array([a for a, _ in COVERS])
+COVER_B = np.array([b for _, b in COVERS])
+
+
+def compute_violated_masks(perms):
+    # one pass over all perms: pos[r, v] is the (last) index of event v in perms[r], -1 if absent;
+    # a cover (a, b) is violated when both are present and a comes after b
+    lengths = np.fromiter((len(p) for p in perms), dtype=np.int64, count=len(perms))
+    values = np.concatenate(perms) if perms else np.empty(0, dtype=np.int64)
+    rows = np.repeat(np.arange(len(perms)), lengths)
+    idx = np.arange(values.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    n_events = int(max(COVER_A.max(), COVER_B.max())) + 1
+    keep = values < n_events
+    pos = np.full((len(perms), n_events), -1, dtype=np.int64)
+    np.maximum.at(pos, (rows[keep], values[keep]), idx[keep])
+    pa, pb = pos[:, COVER_A], pos[:, COVER_B]
+    bits = (pa >= 0) & (pb >= 0) & (pa > pb)
+    return (bits.astype(np.int64) @ (1 << np.arange(len(COVERS)))).tolist()
@@ -15,124 +15,171 @@ Options:
   --write-debug            : write debug CSV of all cluster-pair Jaccards
 """
 import argparse
-import csv
 import glob
 import json
 import math
-from collections import defaultdict
+import warnings
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
+def parse_run_id(path):
+    # run index from filename, e.g. cluster_members_run_003.csv -> 3
+    try:
+        return int(path.stem.split("_")[-1])
+    except Exception:
+        return path.stem
+
 def load_cluster_members(kw_folder):
-    # returns list of (run_id, cluster_id, set_of_perm_indices, perm_strings_if_available)
+    # returns (cluster_list, perm_index_to_string): one entry per (run_id, cluster_id) with its
+    # set of perm indices, and the perm strings from all runs if the files have a perm column
     files = sorted(Path(kw_folder).glob("cluster_members_run_*.csv"))
     if not files:
         raise SystemExit(f"No cluster_members_run_*.csv files found in {kw_folder}")
-    clusters = []
-    for f in files:
-        # run index from filename
-        stem = f.stem
-        # parse run id
-        try:
-            run_id = int(stem.split("_")[-1])
-        except Exception:
-            run_id = stem
-        # read rows
-        with f.open(newline='', encoding='utf8') as fh:
-            reader = csv.reader(fh)
-            header = next(reader, None)
-            # expect header: cluster_id,perm_index,perm
-            for row in reader:
-                if not row:
-                    continue
-                cluster_id = int(row[0])
-                perm_index = int(row[1])
-                perm_str = row[2] if len(row) > 2 else None
-                clusters.append((run_id, cluster_id, perm_index, perm_str))
-    # group by (run_id, cluster_id)
-    grouped = {}
-    for run_id, cluster_id, perm_index, perm_str in clusters:
-        key = (run_id, cluster_id)
-        if key not in grouped:
-            grouped[key] = {"perms": set(), "perm_strs": []}
-        grouped[key]["perms"].add(int(perm_index))
-        if perm_str is not None:
-            grouped[key]["perm_strs"].append((int(perm_index), perm_str))
-    # convert to list
-    cluster_list = []
-    for (run_id, cluster_id), info in sorted(grouped.items()):
-        cluster_list.append({
-            "run_id": run_id,
-            "cluster_id": cluster_id,
-            "perm_indices": info["perms"],
-            "perm_strs": dict(info["perm_strs"])  # map index->string if available
-        })
-    return cluster_list
+    # expect header: cluster_id,perm_index,perm (perm optional)
+    frames = [
+        pd.read_csv(
+            f,
+            usecols=lambda c: c in ("cluster_id", "perm_index", "perm"),
+            dtype={"cluster_id": np.int32, "perm_index": np.int32, "perm": str},
+            # only a missing or empty perm field is NA; any other text is kept as written
+            keep_default_na=False,
+            na_values={"perm": [""]},
+            encoding="utf8",
+        ).assign(run_id=parse_run_id(f))
+        for f in files
+    ]
+    members = pd.concat(frames, ignore_index=True)
+    # stable sort by (run_id, cluster_id) so each cluster is one contiguous block, rows
+    # keeping their file order within it
+    runs = sorted(set(members["run_id"]))
+    run_codes = pd.Categorical(members["run_id"], categories=runs).codes
+    order = np.lexsort((members["cluster_id"].to_numpy(), run_codes))
+    run_codes = run_codes[order]
+    cluster_ids = members["cluster_id"].to_numpy()[order]
+    perm_idx = members["perm_index"].to_numpy()[order]
+    bounds = np.flatnonzero((run_codes[1:] != run_codes[:-1]) | (cluster_ids[1:] != cluster_ids[:-1])) + 1
+    starts = np.r_[0, bounds] if len(perm_idx) else bounds
+    cluster_list = [
+        {"run_id": runs[run_codes[s]], "cluster_id": int(cluster_ids[s]), "perm_indices": set(p.tolist())}
+        for s, p in zip(starts, np.split(perm_idx, bounds))
+    ]
+    # index -> perm string over the same order; a later row overrides an earlier one. Rows
+    # without a perm (short rows, or runs whose file has no perm column) contribute none
+    if "perm" in members.columns:
+        perm_strs = members["perm"].to_numpy()[order]
+        has_perm = pd.notna(perm_strs)
+        perm_index_to_string = dict(zip(perm_idx[has_perm].tolist(), perm_strs[has_perm].tolist()))
+    else:
+        perm_index_to_string = {}
+    return cluster_list, perm_index_to_string
+
+# memory allowed for the matrix-product Jaccard (float32 cluster x permutation matrix plus its
+# float32 n x n product); above this the packed per-row path is used instead
+DENSE_JACCARD_MAX_BYTES = 64 * 2**20
+
+def pack_clusters(cluster_list):
+    # each cluster's sorted perm indices concatenated into one flat array; cluster i is
+    # data[offsets[i]:offsets[i+1]]
+    arrays = [np.sort(np.fromiter(c["perm_indices"], dtype=np.int64, count=len(c["perm_indices"]))) for c in cluster_list]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    data = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+    return data, offsets
 
-def jaccard(a, b):
-    if not a and not b:
-        return 1.0
-    inter = len(a & b)
-    uni = len(a | b)
-    return inter / uni if uni > 0 else 0.0
+def build_membership_matrix(data, offsets):
+    # binary cluster x permutation matrix: X[i, p] = 1 if perm p is a member of cluster i;
+    # float32 keeps the intersection counts of X @ X.T exact up to 2**24
+    n_perms = int(data.max()) + 1 if data.size else 0
+    X = np.zeros((len(offsets) - 1, n_perms), dtype=np.float32)
+    X[np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)), data] = 1.0
+    return X
 
-def build_pairwise_jaccard(cluster_list):
-    n = len(cluster_list)
-    pairs = []
-    for i in range(n):
-        for j in range(i+1, n):
-            a = cluster_list[i]["perm_indices"]
-            b = cluster_list[j]["perm_indices"]
-            val = jaccard(a, b)
-            pairs.append((i, j, val))
-    return pairs
+def packed_intersections(data, offsets):
+    # intersection sizes one cluster at a time: mark members of cluster i across the flat
+    # array, then sum the marks per cluster segment (reduceat needs non-empty segments)
+    n = len(offsets) - 1
+    inter = np.zeros((n, n), dtype=np.float64)
+    nonempty = np.flatnonzero(np.diff(offsets) > 0)
+    for i in nonempty:
+        member = np.isin(data, data[offsets[i]:offsets[i+1]])
+        inter[i, nonempty] = np.add.reduceat(member, offsets[nonempty])
+    return inter
 
-def build_graph_components(n_nodes, pairs, threshold):
-    # adjacency list
-    adj = [[] for _ in range(n_nodes)]
-    for i, j, val in pairs:
-        if val >= threshold:
-            adj[i].append(j)
-            adj[j].append(i)
-    # connected components via DFS
-    visited = [False]*n_nodes
-    components = []
-    for i in range(n_nodes):
-        if visited[i]:
+def jaccard_matrix(data, offsets):
+    n = len(offsets) - 1
+    n_perms = int(data.max()) + 1 if data.size else 0
+    if 4 * n * (n_perms + n) <= DENSE_JACCARD_MAX_BYTES:
+        # all pairwise intersections in one matrix product
+        X = build_membership_matrix(data, offsets)
+        inter = (X @ X.T).astype(np.float64)
+    else:
+        # sparse perm index space: avoid the dense matrix
+        inter = packed_intersections(data, offsets)
+    sizes = np.diff(offsets).astype(np.float64)
+    union = sizes[:, None] + sizes[None, :] - inter
+    # empty-vs-empty counts as 1.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / union, 1.0)
+
+def build_pairwise_jaccard(jmat):
+    # (i, j, jaccard) arrays over all cluster pairs i < j
+    I, J = np.triu_indices(jmat.shape[0], 1)
+    return I, J, jmat[I, J]
+
+def union_find_roots(n_nodes, I, J):
+    # weighted quick-union with path compression over the edge arrays (I[k], J[k])
+    parent = list(range(n_nodes))
+    rank = [0]*n_nodes
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+    for i, j in zip(I.tolist(), J.tolist()):
+        ri, rj = find(i), find(j)
+        if ri == rj:
             continue
-        stack = [i]
-        comp = []
-        visited[i] = True
-        while stack:
-            v = stack.pop()
-            comp.append(v)
-            for w in adj[v]:
-                if not visited[w]:
-                    visited[w] = True
-                    stack.append(w)
-        components.append(sorted(comp))
+        if rank[ri] < rank[rj]:
+            ri, rj = rj, ri
+        parent[rj] = ri
+        if rank[ri] == rank[rj]:
+            rank[ri] += 1
+    return np.array([find(v) for v in range(n_nodes)], dtype=np.int64)
+
+def build_graph_components(jmat, threshold):
+    n_nodes = jmat.shape[0]
+    I, J = np.triu_indices(n_nodes, 1)
+    keep = jmat[I, J] >= threshold
+    roots = union_find_roots(n_nodes, I[keep], J[keep])
+    # group node indices by root; stable sort keeps each component ascending
+    order = np.argsort(roots, kind="stable")
+    bounds = np.flatnonzero(np.diff(roots[order])) + 1
+    components = [comp.tolist() for comp in np.split(order, bounds)] if n_nodes else []
+    # same ordering as before: components listed by their smallest member
+    components.sort(key=lambda comp: comp[0])
     return components
 
-def compute_consensus_for_component(component_indices, cluster_list, consensus_fraction):
+def compute_consensus_for_component(component_indices, cluster_list, consensus_fraction, packed, jmat):
     # gather member clusters
     member_clusters = [cluster_list[i] for i in component_indices]
     m = len(member_clusters)
-    # count permutation occurrences across member clusters
-    perm_counts = defaultdict(int)
-    for c in member_clusters:
-        for p in c["perm_indices"]:
-            perm_counts[p] += 1
+    # count permutation occurrences across member clusters; unique() keeps the counts as
+    # large as the members, not the perm index space
+    data, offsets = packed
+    perms, counts = np.unique(np.concatenate([data[offsets[i]:offsets[i+1]] for i in component_indices]), return_counts=True)
     # consensus perms: those with count >= ceil(consensus_fraction * m)
     threshold = math.ceil(consensus_fraction * m)
-    consensus_perms = sorted([p for p, cnt in perm_counts.items() if cnt >= threshold])
+    consensus_perms = perms[counts >= threshold].tolist()
     # fragmentation: number of distinct runs represented
     runs = sorted({c["run_id"] for c in member_clusters})
-    # mean pairwise jaccard among member clusters
-    # compute all pairwise jaccards
-    jvals = []
-    for i in range(len(member_clusters)):
-        for j in range(i+1, len(member_clusters)):
-            jvals.append(jaccard(member_clusters[i]["perm_indices"], member_clusters[j]["perm_indices"]))
-    mean_jaccard = sum(jvals)/len(jvals) if jvals else 1.0
+    # mean pairwise jaccard among member clusters, read from the global Jaccard matrix
+    sub = jmat[np.ix_(component_indices, component_indices)]
+    jvals = sub[np.triu_indices(m, 1)]
+    mean_jaccard = float(jvals.mean()) if jvals.size else 1.0
     return {
         "member_clusters": [(c["run_id"], c["cluster_id"]) for c in member_clusters],
         "n_member_clusters": m,
@@ -140,90 +187,95 @@ def compute_consensus_for_component(component_indices, cluster_list, consensus_f
         "fragmentation": len(runs),
         "mean_pairwise_jaccard": mean_jaccard,
         "consensus_perms": consensus_perms,
-        "perm_counts": perm_counts
+        "perm_counts": dict(zip(perms.tolist(), counts.tolist()))
     }
 
-def load_permutation_strings_from_any(cluster_list):
-    # try to recover perm strings mapping from cluster_list entries that have perm_strs
-    mapping = {}
-    for c in cluster_list:
-        for idx, s in c.get("perm_strs", {}).items():
-            mapping[int(idx)] = s
-    return mapping
+def decode_perm_strings(perm_index_to_string):
+    # parse each "1;2;3;..." perm string once per run into an int array. np.fromstring does the
+    # parse in C; it only warns (and truncates) on empty or bad tokens, so that warning is raised
+    # and such strings go through the token-wise parser instead
+    perm_arrays = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        for pidx, s in perm_index_to_string.items():
+            try:
+                perm_arrays[pidx] = np.fromstring(s, dtype=np.int64, sep=";")
+            except (DeprecationWarning, ValueError):
+                perm_arrays[pidx] = np.array([int(x) for x in s.split(";") if x != ""], dtype=np.int64)
+    return perm_arrays
 
-def compute_event_position_stats(consensus_perms, perm_index_to_string):
-    # perm strings are like "1;2;3;..." ; compute for each event id mean normalized position across consensus perms
+def compute_event_position_stats(consensus_perms, perm_arrays):
+    # compute for each event id mean normalized position across consensus perms
     if not consensus_perms:
         return {}
-    # build list of permutations as lists
     perms = []
     for pidx in consensus_perms:
-        s = perm_index_to_string.get(pidx)
-        if s is None:
+        arr = perm_arrays.get(pidx)
+        if arr is None:
             # cannot compute positions without perm strings
             return {}
-        arr = [int(x) for x in s.split(";") if x != ""]
         perms.append(arr)
-    # determine node set
-    nodes = sorted({v for perm in perms for v in perm})
-    n = len(nodes)
-    pos_stats = {}
-    for node in nodes:
-        positions = []
-        for perm in perms:
-            if node in perm:
-                positions.append(perm.index(node) / max(1, len(perm)-1))
-        pos_stats[node] = sum(positions)/len(positions) if positions else None
-    return pos_stats
+    # flatten all perms; each element carries its perm id and normalized position
+    lengths = np.array([len(p) for p in perms], dtype=np.int64)
+    values = np.concatenate(perms)
+    if values.size == 0:
+        return {}
+    perm_ids = np.repeat(np.arange(len(perms)), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    norm_pos = (np.arange(values.size) - starts) / np.repeat(np.maximum(1, lengths - 1), lengths)
+    # only the first occurrence of an event within a perm counts, as with list.index()
+    _, first = np.unique(np.stack([perm_ids, values]), axis=1, return_index=True)
+    nodes, inv = np.unique(values[first], return_inverse=True)
+    means = np.bincount(inv, weights=norm_pos[first]) / np.bincount(inv)
+    return dict(zip(nodes.tolist(), means.tolist()))
 
 def write_csv_consensus(outdir, consensus_groups):
     path = Path(outdir) / "consensus_motifs.csv"
-    with path.open("w", newline='', encoding='utf8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["consensus_id","n_member_clusters","fragmentation","mean_pairwise_jaccard","n_consensus_perms","member_clusters","consensus_perms"])
-        for cid, g in enumerate(consensus_groups):
-            writer.writerow([
-                cid,
-                g["n_member_clusters"],
-                g["fragmentation"],
-                f"{g['mean_pairwise_jaccard']:.6g}",
-                len(g["consensus_perms"]),
-                ";".join([f"{r}-{c}" for r,c in g["member_clusters"]]),
-                ";".join(str(x) for x in g["consensus_perms"])
-            ])
+    pd.DataFrame({
+        "consensus_id": range(len(consensus_groups)),
+        "n_member_clusters": [g["n_member_clusters"] for g in consensus_groups],
+        "fragmentation": [g["fragmentation"] for g in consensus_groups],
+        "mean_pairwise_jaccard": [g["mean_pairwise_jaccard"] for g in consensus_groups],
+        "n_consensus_perms": [len(g["consensus_perms"]) for g in consensus_groups],
+        "member_clusters": [";".join([f"{r}-{c}" for r,c in g["member_clusters"]]) for g in consensus_groups],
+        "consensus_perms": [";".join(str(x) for x in g["consensus_perms"]) for g in consensus_groups],
+    }).to_csv(path, index=False, encoding="utf8", float_format="%.6g")
     return path
 
 def write_csv_summary(outdir, consensus_groups):
     path = Path(outdir) / "motif_stability_summary.csv"
-    with path.open("w", newline='', encoding='utf8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["consensus_id","n_member_clusters","fragmentation","mean_pairwise_jaccard","n_consensus_perms"])
-        for cid, g in enumerate(consensus_groups):
-            writer.writerow([cid, g["n_member_clusters"], g["fragmentation"], f"{g['mean_pairwise_jaccard']:.6g}", len(g["consensus_perms"])])
+    pd.DataFrame({
+        "consensus_id": range(len(consensus_groups)),
+        "n_member_clusters": [g["n_member_clusters"] for g in consensus_groups],
+        "fragmentation": [g["fragmentation"] for g in consensus_groups],
+        "mean_pairwise_jaccard": [g["mean_pairwise_jaccard"] for g in consensus_groups],
+        "n_consensus_perms": [len(g["consensus_perms"]) for g in consensus_groups],
+    }).to_csv(path, index=False, encoding="utf8", float_format="%.6g")
     return path
 
-def write_event_positions(outdir, consensus_groups, perm_index_to_string):
+def write_event_positions(outdir, consensus_groups, perm_arrays):
     path = Path(outdir) / "consensus_event_positions.csv"
-    with path.open("w", newline='', encoding='utf8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["consensus_id","event_id","mean_normalized_position"])
-        for cid, g in enumerate(consensus_groups):
-            pos_stats = compute_event_position_stats(g["consensus_perms"], perm_index_to_string)
-            if not pos_stats:
-                continue
-            for node, meanpos in sorted(pos_stats.items()):
-                writer.writerow([cid, node, "" if meanpos is None else f"{meanpos:.6g}"])
+    cids, nodes, means = [], [], []
+    for cid, g in enumerate(consensus_groups):
+        pos_stats = compute_event_position_stats(g["consensus_perms"], perm_arrays)
+        for node, meanpos in sorted(pos_stats.items()):
+            cids.append(cid); nodes.append(node); means.append(meanpos)
+    pd.DataFrame({"consensus_id": cids, "event_id": nodes, "mean_normalized_position": means}).to_csv(
+        path, index=False, encoding="utf8", float_format="%.6g")
     return path
 
-def write_debug_pairs(outdir, pairs, cluster_list):
+def write_debug_pairs(outdir, jmat, cluster_list):
     path = Path(outdir) / "debug_cluster_pairs.csv"
-    with path.open("w", newline='', encoding='utf8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["i","j","run_i","cluster_i","run_j","cluster_j","jaccard"])
-        for i, j, val in pairs:
-            ci = cluster_list[i]
-            cj = cluster_list[j]
-            writer.writerow([i, j, ci["run_id"], ci["cluster_id"], cj["run_id"], cj["cluster_id"], f"{val:.6g}"])
+    # one frame built straight from the upper triangle of the Jaccard matrix
+    I, J, vals = build_pairwise_jaccard(jmat)
+    run_ids = np.array([c["run_id"] for c in cluster_list], dtype=object)
+    cluster_ids = np.array([c["cluster_id"] for c in cluster_list], dtype=np.int64)
+    pd.DataFrame({
+        "i": I, "j": J,
+        "run_i": run_ids[I], "cluster_i": cluster_ids[I],
+        "run_j": run_ids[J], "cluster_j": cluster_ids[J],
+        "jaccard": vals,
+    }).to_csv(path, index=False, encoding="utf8", float_format="%.6g")
     return path
 
 def main():
@@ -243,31 +295,32 @@ def main():
     outdir.mkdir(parents=True, exist_ok=True)
 
     print("Loading cluster members...")
-    cluster_list = load_cluster_members(kw_folder)
+    cluster_list, perm_index_to_string = load_cluster_members(kw_folder)
     print(f"Loaded {len(cluster_list)} clusters from runs")
 
     print("Computing pairwise Jaccard...")
-    pairs = build_pairwise_jaccard(cluster_list)
+    packed = pack_clusters(cluster_list)
+    jmat = jaccard_matrix(*packed)
     if args.write_debug:
-        write_debug_pairs(outdir, pairs, cluster_list)
+        write_debug_pairs(outdir, jmat, cluster_list)
         print("Wrote debug_cluster_pairs.csv")
 
     print("Building consensus groups with Jaccard threshold", args.jaccard_threshold)
-    components = build_graph_components(len(cluster_list), pairs, args.jaccard_threshold)
+    components = build_graph_components(jmat, args.jaccard_threshold)
     print(f"Found {len(components)} consensus groups")
 
     consensus_groups = []
     for comp in components:
-        g = compute_consensus_for_component(comp, cluster_list, args.consensus_fraction)
+        g = compute_consensus_for_component(comp, cluster_list, args.consensus_fraction, packed, jmat)
         consensus_groups.append(g)
 
-    # try to recover perm strings for event position stats
-    perm_index_to_string = load_permutation_strings_from_any(cluster_list)
+    # decode perm strings for event position stats
+    perm_arrays = decode_perm_strings(perm_index_to_string)
 
     # write outputs
     write_csv_consensus(outdir, consensus_groups)
     write_csv_summary(outdir, consensus_groups)
-    write_event_positions(outdir, consensus_groups, perm_index_to_string)
+    write_event_positions(outdir, consensus_groups, perm_arrays)
     print("Wrote consensus_motifs.csv, motif_stability_summary.csv, consensus_event_positions.csv to", outdir)
 
 if __name__ == "__main__":
@@ -12,11 +12,20 @@ THRESHOLD = 0.40
 if not os.path.exists(INPUT_FN):
     sys.exit(f"File not found: {INPUT_FN}")
 
-df = pd.read_csv(INPUT_FN, dtype=str).fillna("")
+# read only the columns used below
+MOTIF_COLS = ["motif_label", "human_mapped", "rule_any_label"]
+df = pd.read_csv(
+    INPUT_FN,
+    usecols=lambda c: c == "stability_fraction" or c in MOTIF_COLS,
+    dtype={c: str for c in MOTIF_COLS},
+    na_values=[""],
+)
 if "stability_fraction" not in df.columns:
     sys.exit("stability_fraction column not found in CSV")
-
-# ensure numeric
+# blank labels stay "" as in the all-text read; non-numeric stability cells become NaN
+# and are never flagged
+label_cols = [c for c in MOTIF_COLS if c in df.columns]
+df[label_cols] = df[label_cols].fillna("")
 df["stability_fraction"] = pd.to_numeric(df["stability_fraction"], errors="coerce")
 
 # pick motif column (in order of preference)
@@ -31,13 +40,14 @@ else:
 
 df[motif_col] = df[motif_col].fillna("UNLABELED")
 
-# compute totals and flagged counts
-total_per_motif = df.groupby(motif_col).size().reset_index(name="total_rows")
+# compute totals and flagged counts in one groupby pass
 flag_mask = df["stability_fraction"] < THRESHOLD
-flagged_per_motif = df[flag_mask].groupby(motif_col).size().reset_index(name="count_below_0.40")
-
-summary = total_per_motif.merge(flagged_per_motif, on=motif_col, how="left").fillna(0)
-summary["count_below_0.40"] = summary["count_below_0.40"].astype(int)
+summary = (
+    df.assign(flag=flag_mask)
+    .groupby(motif_col, observed=True)
+    .agg(total_rows=("flag", "size"), **{"count_below_0.40": ("flag", "sum")})
+    .reset_index()
+)
 summary["fraction_below_0.40"] = summary["count_below_0.40"] / summary["total_rows"]
 
 summary = summary.sort_values("count_below_0.40", ascending=False)
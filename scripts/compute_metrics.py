@@ -1,36 +1,87 @@
 ﻿#!/usr/bin/env python3
 import argparse, json, csv
+import numpy as np
 import pandas as pd
 
 def load_perms(path):
     df = pd.read_csv(path)
     perm_cols = [c for c in df.columns if c.startswith("pos_")]
-    return df[perm_cols].values.tolist()
+    return df[perm_cols].to_numpy(dtype=np.int64)
 
 def load_segmentation(path):
     # use utf-8-sig to accept files with or without a BOM
     with open(path, 'r', encoding='utf-8-sig') as f:
         return json.load(f)
 
-def kendall_distance(p, q):
-    n = len(p); pos = {v:i for i,v in enumerate(p)}; qpos = [pos[v] for v in q]
-    inv = 0
-    for i in range(n):
-        for j in range(i+1, n):
-            if qpos[i] > qpos[j]:
-                inv += 1
-    max_inv = n*(n-1)//2
-    return inv / max_inv if max_inv > 0 else 0.0
-
-def disp_kappa(perm, canon, kappa):
-    return sum(abs(perm.index(canon[i]) - i)**kappa for i in range(len(canon)))
-
-def adjacency_violations(perm, covers):
-    pos = {v:i for i,v in enumerate(perm)}; violations = 0
-    for a,b in covers:
-        if pos[a] >= pos[b]:
-            violations += 1
-    return violations
+def count_inversions(arr):
+    # bottom-up merge sort: counts pairs i < j with arr[i] > arr[j] in O(n log n)
+    a = [int(x) for x in arr]; n = len(a); inv = 0; width = 1
+    while width < n:
+        merged = []
+        for lo in range(0, n, 2*width):
+            left = a[lo:lo+width]; right = a[lo+width:lo+2*width]
+            i = j = 0
+            while i < len(left) and j < len(right):
+                if left[i] <= right[j]:
+                    merged.append(left[i]); i += 1
+                else:
+                    merged.append(right[j]); j += 1
+                    inv += len(left) - i
+            merged.extend(left[i:]); merged.extend(right[j:])
+        a = merged; width *= 2
+    return inv
+
+def position_array(p):
+    # pos[v] = index of value v in p
+    p = np.asarray(p, dtype=np.int64)
+    pos = np.empty(int(p.max()) + 1 if len(p) else 0, dtype=np.int64); pos[p] = np.arange(len(p))
+    return pos
+
+def kendall_distance(p, q, pos=None):
+    # pos: optional cached position_array(p), reused when p is fixed across many q
+    n = len(p); max_inv = n*(n-1)//2
+    if max_inv == 0:
+        return 0.0
+    if pos is None:
+        pos = position_array(p)
+    return count_inversions(pos[np.asarray(q, dtype=np.int64)]) / max_inv
+
+def inverse_perms(perm_arr):
+    # row r of the result holds the 0-based position of each value 1..n in perm_arr[r]
+    inv = np.empty_like(perm_arr); n = perm_arr.shape[1]
+    np.put_along_axis(inv, perm_arr - 1, np.broadcast_to(np.arange(n), perm_arr.shape), axis=1)
+    return inv
+
+def disp_kappa(inv_perms, kappa):
+    # displacements are integers < n, so each d**kappa is looked up in a table built with Python
+    # float pow (numpy's ** can differ in the last ULP), and the terms are added left to right
+    # like the per-row sum() rather than with np.sum's pairwise summation
+    n = inv_perms.shape[1]
+    tab = np.array([float(k) ** kappa for k in range(n)])
+    terms = tab[np.abs(inv_perms - np.arange(n))]
+    total = np.zeros(len(inv_perms))
+    for j in range(n):
+        total += terms[:, j]
+    return total
+
+def adjacency_violations(inv_perms, covers):
+    covers_arr = np.asarray(covers, dtype=np.int64).reshape(-1, 2)
+    a = covers_arr[:, 0] - 1; b = covers_arr[:, 1] - 1
+    return (inv_perms[:, a] >= inv_perms[:, b]).sum(axis=1)
+
+def longest_true_run(mask):
+    best = cur = 0
+    for v in mask:
+        cur = cur + 1 if v else 0
+        if cur > best:
+            best = cur
+    return best
+
+def max_block_move(perm):
+    # canon is 1..n, so a canonical block canon[i:j] occurs contiguously in perm
+    # iff perm holds a run of j-i consecutive ascending integers
+    runs = np.diff(np.asarray(perm, dtype=np.int64)) == 1
+    return 1 + longest_true_run(runs)
 
 def main():
     p = argparse.ArgumentParser()
@@ -45,7 +96,6 @@ def main():
     perms = load_perms(args.perms_file)
     seg = load_segmentation(args.segmentation_file)
     nodes = list(range(1, len(seg) + 1)); canon = nodes
-    rows = []
 
     # load covers from poset file if present next to segmentation file
     try:
@@ -59,38 +109,37 @@ def main():
     except Exception:
         covers = [(i, i+1) for i in range(1, len(seg))]
 
-    for idx, perm in enumerate(perms):
-        dK = kendall_distance(canon, perm)
-        disp = disp_kappa(perm, canon, args.kappa)
-        disp_scaled = disp * (1 + args.alpha * (disp**2))
-        adj_viol = adjacency_violations(perm, covers)
-        single_move = max(abs(perm.index(i+1) - i) for i in range(len(seg)))
-        max_block = 1
-        n = len(seg)
-        for i in range(n):
-            for j in range(i+1, n+1):
-                block = canon[i:j]
-                for k in range(n - (j - i) + 1):
-                    if perm[k:k+(j-i)] == block:
-                        max_block = max(max_block, j - i)
-        rev = list(reversed(canon)); dual_prox = kendall_distance(rev, perm)
-        score_dir = 1.0 - (0.6 * dK + 0.4 * (disp_scaled / (1 + disp_scaled)))
-        rows.append({
-            'perm_index': idx,
-            'dK': dK,
-            'disp_kappa_scaled': disp_scaled,
-            'adjacency_violations': adj_viol,
-            'single_move': single_move,
-            'max_block_move': max_block,
-            'order_dual_proximity': dual_prox,
-            'score_dir': score_dir,
-            'connective_density_per_100': 0.0,
-            'pos_weighted_connectives': 0.0,
-            'sent_connective_sd': 0.0,
-            'max_sent_connectives': 0.0
-        })
-
-    df = pd.DataFrame(rows)
+    canon_arr = np.asarray(canon, dtype=np.int64); rev_arr = canon_arr[::-1]
+    canon_pos = position_array(canon_arr); rev_pos = position_array(rev_arr)
+    n_perms = len(perms)
+
+    # structure-of-arrays: every metric is computed as one column over all permutations
+    inv_perms = inverse_perms(perms)
+    dK = np.array([kendall_distance(canon_arr, perm, canon_pos) for perm in perms], dtype=float)
+    disp = disp_kappa(inv_perms, args.kappa)
+    # disp**2 through Python float pow as well: numpy squares as x*x, which can round differently
+    disp_sq = np.array([x ** 2 for x in disp.tolist()])
+    disp_scaled = disp * (1 + args.alpha * disp_sq)
+    adj_viol = adjacency_violations(inv_perms, covers)
+    single_move = np.abs(inv_perms - np.arange(len(seg))).max(axis=1)
+    max_block = np.array([max_block_move(perm) for perm in perms], dtype=np.int64)
+    dual_prox = np.array([kendall_distance(rev_arr, perm, rev_pos) for perm in perms], dtype=float)
+    score_dir = 1.0 - (0.6 * dK + 0.4 * (disp_scaled / (1 + disp_scaled)))
+
+    df = pd.DataFrame({
+        'perm_index': np.arange(n_perms),
+        'dK': dK,
+        'disp_kappa_scaled': disp_scaled,
+        'adjacency_violations': adj_viol,
+        'single_move': single_move,
+        'max_block_move': max_block,
+        'order_dual_proximity': dual_prox,
+        'score_dir': score_dir,
+        'connective_density_per_100': 0.0,
+        'pos_weighted_connectives': 0.0,
+        'sent_connective_sd': 0.0,
+        'max_sent_connectives': 0.0
+    })
     df.to_csv(args.out, index=False)
     print("Wrote", args.out)
 
@@ -8,12 +8,17 @@ args = parser.parse_args()
 
 os.makedirs(os.path.dirname(args.out), exist_ok=True)
 with open(args.labels, newline='') as inf, open(args.out, "w", newline='') as outf:
-    reader = csv.DictReader(inf)
-    fieldnames = reader.fieldnames + ["adjudicator_note","final_label"]
-    writer = csv.DictWriter(outf, fieldnames=fieldnames)
-    writer.writeheader()
-    for r in reader:
-        r["adjudicator_note"] = ""
-        r["final_label"] = ""
-        writer.writerow(r)
+    reader = csv.reader(inf)
+    writer = csv.writer(outf)
+    header = next(reader)
+    writer.writerow(header + ["adjudicator_note","final_label"])
+    # pad short rows to the header width, then append the two empty adjudication fields;
+    # longer rows would shift those fields out of their columns, so they are rejected
+    pad = [""] * len(header)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) > len(header):
+            raise ValueError(f"{args.labels}, line {reader.line_num}: {len(row)} fields, header has {len(header)}")
+        writer.writerow(row + pad[len(row):] + ["",""])
 print("Wrote:", args.out)
\ No newline at end of file
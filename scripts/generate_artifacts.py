@@ -4,12 +4,16 @@
 # Usage: python supplement/artifacts/generate_artifacts.py
 # Requires: pandas, numpy, matplotlib, seaborn
 
+import csv
 import os
 from datetime import datetime
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # headless: no GUI backend import on CI
 import matplotlib.pyplot as plt
 import seaborn as sns
+from _bootstrap import rank_concordance_bootstrap, write_parquet_copy
 
 # Reproducibility
 RNG_SEED = 42
@@ -33,7 +37,9 @@ os.makedirs(ADJ_DIR, exist_ok=True)
 # Read inputs
 if not os.path.exists(DIAG_PATH):
     raise FileNotFoundError(f"Missing required file: {DIAG_PATH}")
-diag = pd.read_csv(DIAG_PATH)
+# diagnostics are streamed in chunks for the per-row tables (sections 1 and 3);
+# section 2 needs the whole structural_metric column and reads only that
+DIAG_CHUNKSIZE = 50_000
 
 reader_sum = None
 if os.path.exists(READER_SUM_PATH):
@@ -53,45 +59,90 @@ mapping = {
 }
 labels_list = ["BRE", "FM_EM", "APD", "DCO", "GD", "Other"]
 
-rows = []
-for _, r in diag.iterrows():
-    motif = r.get("motif_label", "")
-    primary = mapping.get(motif, "Other")
-    row = {
-        "exemplar_id": r.get("exemplar_id", ""),
-        "permutation": r.get("permutation", ""),
+label_cols = [f"label_{L}" for L in labels_list]
+stable_cols = [f"stable_{L}" for L in labels_list]
+
+
+def diag_column(diag, name):
+    return diag[name] if name in diag.columns else pd.Series("", index=diag.index)
+
+
+def build_order_flags(diag):
+    # built column-wise; unmapped or missing motif labels fall back to "Other"
+    # label/stable flags are int8 and primary_label is categorical over labels_list
+    primary = diag_column(diag, "motif_label").map(mapping).fillna("Other").astype(pd.CategoricalDtype(labels_list))
+    one_hot = pd.get_dummies(primary).reindex(columns=labels_list, fill_value=0).astype("int8")
+    order_flags = pd.DataFrame({
+        "exemplar_id": diag_column(diag, "exemplar_id"),
+        "permutation": diag_column(diag, "permutation"),
         "primary_label": primary,
-    }
+    })
     for L in labels_list:
-        row[f"label_{L}"] = 1 if L == primary else 0
+        order_flags[f"label_{L}"] = one_hot[L]
         # Simulated stability flags for demo: mark primary as stable
-        row[f"stable_{L}"] = 1 if L == primary else 0
-    rows.append(row)
+        order_flags[f"stable_{L}"] = one_hot[L]
+    return order_flags
 
-order_flags = pd.DataFrame(rows)
+
+def adjudication_candidates(order_flags):
+    # one numpy pass builds the selection mask; the frame is filtered once and only the
+    # selected rows get label_sum / primary_unstable
+    label_sum = order_flags[label_cols].to_numpy().sum(axis=1)
+    # primary_unstable: gather each row's stable_<primary> flag in one fancy-indexing step
+    # (primary_label codes index labels_list, see build_order_flags)
+    stable_mat = order_flags[stable_cols].to_numpy()
+    label_idx = order_flags["primary_label"].cat.codes.to_numpy()
+    primary_unstable = stable_mat[np.arange(len(order_flags)), label_idx] == 0
+    keep = (label_sum > 1) | primary_unstable
+    return order_flags[keep].assign(label_sum=label_sum[keep], primary_unstable=primary_unstable[keep].astype(int))
+
+
+def write_rows(writer, df):
+    # rows go straight from column lists to csv.writer; NaN cells become None and are
+    # written blank, as DataFrame.to_csv would
+    cols = [df[c].astype(object).where(df[c].notna(), None).tolist() if df[c].hasnans else df[c].tolist()
+            for c in df.columns]
+    writer.writerows(zip(*cols))
+
+
+# sections 1 and 3 are row-local, so each chunk is flagged and appended to both tables
 order_flags_path = os.path.join(ARTIFACTS_DIR, "order_invariant_multilabel_flags.csv")
-order_flags.to_csv(order_flags_path, index=False, encoding="utf-8")
+amb_path = os.path.join(ADJ_DIR, "adjudication_candidates.csv")
+with open(order_flags_path, "w", newline="", encoding="utf-8") as f_flags, \
+        open(amb_path, "w", newline="", encoding="utf-8") as f_amb:
+    # passthrough columns are read as text: per-chunk dtype inference would otherwise write the
+    # same column as "47" in one chunk and "40.0" in another (NaNs force float)
+    chunks = pd.read_csv(
+        DIAG_PATH,
+        chunksize=DIAG_CHUNKSIZE,
+        usecols=lambda c: c in ("exemplar_id", "permutation", "motif_label"),
+        dtype=str,
+    )
+    w_flags = csv.writer(f_flags, lineterminator="\n")
+    w_amb = csv.writer(f_amb, lineterminator="\n")
+    for i, chunk in enumerate(chunks):
+        order_flags = build_order_flags(chunk)
+        ambiguous = adjudication_candidates(order_flags)
+        if i == 0:
+            w_flags.writerow(order_flags.columns)
+            w_amb.writerow(ambiguous.columns)
+        write_rows(w_flags, order_flags)
+        write_rows(w_amb, ambiguous)
 
 # 2) randomized stability tests
-if "structural_metric" not in diag.columns:
+base = pd.read_csv(DIAG_PATH, usecols=lambda c: c in ("exemplar_id", "structural_metric"))
+if "structural_metric" not in base.columns:
     raise ValueError("structural_metric column missing in diagnostics_per_exemplar.csv")
 
-base = diag[["exemplar_id", "structural_metric"]].copy()
-base["base_rank"] = base["structural_metric"].rank(method="min", ascending=True)
 
 N_BOOT = 500
-bootstrap_rows = []
-rng = np.random.default_rng(RNG_SEED)
-for b in range(N_BOOT):
-    noise = rng.normal(loc=1.0, scale=0.05, size=len(base))
-    pert = base["structural_metric"].values * noise
-    pert_rank = pd.Series(pert).rank(method="min", ascending=True)
-    concord = (pert_rank.values == base["base_rank"].values).mean()
-    bootstrap_rows.append({"bootstrap": b, "rank_concordance": float(concord)})
-
-bs_df = pd.DataFrame(bootstrap_rows)
+BOOT_BATCH = 100  # replicates per (BOOT_BATCH, n) noise matrix; bounds memory for large n
+concord = rank_concordance_bootstrap(base["structural_metric"], n_boot=N_BOOT, scale=0.05, seed=RNG_SEED, batch=BOOT_BATCH)
+
+bs_df = pd.DataFrame({"bootstrap": np.arange(N_BOOT), "rank_concordance": concord})
 bs_path = os.path.join(STABILITY_DIR, "stability_bootstrap_samples.csv")
 bs_df.to_csv(bs_path, index=False, encoding="utf-8")
+write_parquet_copy(bs_df, bs_path)
 
 # summary
 mean_c = bs_df["rank_concordance"].mean()
@@ -105,7 +156,7 @@ summary_df.to_csv(summary_path, index=False, encoding="utf-8")
 # plot histogram
 sns.set(style="whitegrid")
 plt.figure(figsize=(6, 4))
-sns.histplot(bs_df["rank_concordance"], bins=30, kde=False, color="#4c72b0")
+plt.hist(bs_df["rank_concordance"].to_numpy(), bins=30, color="#4c72b0", rasterized=True)
 plt.xlabel("Rank concordance (fraction identical ranks)")
 plt.ylabel("Count")
 plt.title(f"Bootstrap rank concordance (N={N_BOOT})")
@@ -114,25 +165,7 @@ plot_path = os.path.join(STABILITY_PLOTS, "rank_concordance.png")
 plt.savefig(plot_path, dpi=200)
 plt.close()
 
-# 3) adjudication files
-label_cols = [f"label_{L}" for L in labels_list]
-stable_cols = [f"stable_{L}" for L in labels_list]
-
-flags = order_flags.copy()
-flags["label_sum"] = flags[label_cols].sum(axis=1)
-
-
-def primary_unstable(row):
-    prim = row["primary_label"]
-    col = f"stable_{prim}"
-    return int(row.get(col, 1) == 0)
-
-
-flags["primary_unstable"] = flags.apply(primary_unstable, axis=1)
-ambiguous = flags[(flags["label_sum"] > 1) | (flags["primary_unstable"] == 1)].copy()
-amb_path = os.path.join(ADJ_DIR, "adjudication_candidates.csv")
-ambiguous.to_csv(amb_path, index=False, encoding="utf-8")
-
+# 3) adjudication files (candidates are written alongside section 1)
 # adjudication log template
 log_path = os.path.join(ADJ_DIR, "adjudication_log.csv")
 pd.DataFrame(columns=["exemplar_id", "initial_labels", "adjudicator", "timestamp", "final_label", "notes"]).to_csv(
@@ -14,7 +14,7 @@ diag = pd.read_csv("supplement/diagnostics_per_exemplar.csv")
 # In your pipeline this should call the real classifier/heuristic.
 def assign_labels(row):
     # primary label from motif_label column
-    primary = row.get("motif_label", "")
+    primary = getattr(row, "motif_label", "")
     labels = { "BRE":0, "FM/EM":0, "APD":0, "DCO":0, "GD":0, "Other":0 }
     if primary in labels:
         labels[primary] = 1
@@ -25,7 +25,7 @@ def assign_labels(row):
 
 # Build base table
 rows = []
-for _, r in diag.iterrows():
+for r in diag.itertuples(index=False):
     labels = assign_labels(r)
     # order-invariant test: apply small random within-class permutations and reassign
     # Here we simulate by repeating label assignment N times (replace with real perturbation)
@@ -39,9 +39,9 @@ for _, r in diag.iterrows():
                 stable_counts[k] += 1
     stable_flags = {k: (stable_counts[k] == N) for k in stable_counts}
     row = {
-        "exemplar_id": r["exemplar_id"],
-        "permutation": r.get("permutation",""),
-        "primary_label": r.get("motif_label",""),
+        "exemplar_id": r.exemplar_id,
+        "permutation": getattr(r, "permutation", ""),
+        "primary_label": getattr(r, "motif_label", ""),
     }
     # add label columns
     for k in labels:
@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
 # motif_stability_test.py
-# Computes motif stability by randomizing cover-check order.
+# Computes motif stability over all cover-check orders.
 # Usage:
 #   python motif_stability_test.py [path/to/all_motifs_520.csv]
 
-import csv
-import random
+import itertools
 import os
 import sys
-from collections import Counter
 import pandas as pd
+from _covers import BRE_MASK, COVERS, EARLY_MASK, FRONT_MASK, LATE_MASK, compute_violated_masks, mask_to_covers, parse_perms
 
 # Allow passing the input filename as the first CLI argument
 if len(sys.argv) > 1:
@@ -26,122 +25,93 @@ if not os.path.exists(INPUT):
 OUT_PERM = "motif_stability_per_permutation.csv"
 OUT_SUMMARY = "motif_stability_summary.csv"
 
-# CONFIG: number of random cover-check orders to sample per permutation
-N_RANDOM_ORDERS = 500   # increase to 2000 for higher precision if you have time
+# Motif labels; the first-violated classifier returns an index into LABELS
+LABELS = ["GlobalDistortion", "FrontEndMove", "BlockReorderExtreme",
+          "DualClusterOutlier", "AnchorPreservingDisorder", "Other"]
+GD, FEM, BRE, DCO, APD, OTHER = range(len(LABELS))
 
-# canonical covers used by mapping rules
-COVERS = [
-    (1, 3), (1, 4), (1, 5),
-    (3, 8), (4, 8), (5, 6), (6, 7), (7, 8), (8, 9),
-    (9, 10), (10, 11), (11, 12)
-]
-
-def parse_perm(s):
-    if s is None:
-        return []
-    tokens = str(s).strip().split()
-    return [int(t) for t in tokens if t.strip().isdigit()]
-
-def compute_violated_covers_from_perm(perm):
-    pos = {v: i for i, v in enumerate(perm)}
-    violated = []
-    for a, b in COVERS:
-        if a in pos and b in pos and pos[a] > pos[b]:
-            violated.append((a, b))
-    return set(violated)
-
-# Mapping rules (first-violated with a cover_check_order)
-def classify_first_violated(violated_set, cover_check_order):
+# Mapping rules (first-violated with a cover_check_order of cover indices)
+def classify_first_violated(violated, cover_check_order):
     # 1. GlobalDistortion — many violations (4 or more).
-    if len(violated_set) >= 4:
-        return "GlobalDistortion"
+    if bin(violated).count("1") >= 4:
+        return GD
     # 2. FrontEndMove — violates any front covers (1,3), (1,4), (1,5).
-    front = {(1, 3), (1, 4), (1, 5)}
-    for cov in cover_check_order:
-        if cov in violated_set and cov in front:
-            return "FrontEndMove"
+    for i in cover_check_order:
+        if violated & FRONT_MASK & (1 << i):
+            return FEM
     # 3. BlockReorderExtreme — violates any block/chain covers among the set
-    bre_set = {(3, 8), (4, 8), (5, 6), (6, 7), (7, 8), (8, 9)}
-    for cov in cover_check_order:
-        if cov in violated_set and cov in bre_set:
-            return "BlockReorderExtreme"
+    for i in cover_check_order:
+        if violated & BRE_MASK & (1 << i):
+            return BRE
     # 4. DualClusterOutlier — violates at least one early cover and at least one late cover
-    early = front
-    late = {(9, 10), (10, 11), (11, 12)}
-    if any(c in violated_set for c in early) and any(c in violated_set for c in late):
-        for cov in cover_check_order:
-            if cov in violated_set and (cov in early or cov in late):
-                return "DualClusterOutlier"
+    if violated & EARLY_MASK and violated & LATE_MASK:
+        for i in cover_check_order:
+            if violated & (EARLY_MASK | LATE_MASK) & (1 << i):
+                return DCO
     # 5. AnchorPreservingDisorder — has violations but does not violate any front covers
-    if len(violated_set) > 0 and not any(c in violated_set for c in front):
-        return "AnchorPreservingDisorder"
+    if violated and not violated & FRONT_MASK:
+        return APD
     # 6. Other
-    return "Other"
+    return OTHER
 
 # Order-invariant classification (any-cover)
-def classify_any_cover(violated_set):
-    if len(violated_set) >= 4:
+def classify_any_cover(violated):
+    if bin(violated).count("1") >= 4:
         return "GlobalDistortion"
-    front = {(1, 3), (1, 4), (1, 5)}
-    bre_set = {(3, 8), (4, 8), (5, 6), (6, 7), (7, 8), (8, 9)}
-    early = front
-    late = {(9, 10), (10, 11), (11, 12)}
-    if any(c in violated_set for c in front):
+    if violated & FRONT_MASK:
         return "FrontEndMove"
-    if any(c in violated_set for c in bre_set):
+    if violated & BRE_MASK:
         return "BlockReorderExtreme"
-    if any(c in violated_set for c in early) and any(c in violated_set for c in late):
+    if violated & EARLY_MASK and violated & LATE_MASK:
         return "DualClusterOutlier"
-    if len(violated_set) > 0 and not any(c in violated_set for c in front):
+    if violated and not violated & FRONT_MASK:
         return "AnchorPreservingDisorder"
     return "Other"
 
 # Read input CSV (expects header with 'motif' and 'perm' columns; falls back to second column)
-rows = []
-with open(INPUT, newline='') as f:
-    reader = csv.DictReader(f)
-    for r in reader:
-        perm_field = r.get("perm") or r.get("permutation") or r.get("permuted") or None
-        if perm_field is None:
-            # fallback: take the second column value
-            vals = list(r.values())
-            if len(vals) >= 2:
-                perm_field = vals[1]
-            else:
-                perm_field = ""
-        rows.append({"orig_motif": r.get("motif", ""), "perm_str": perm_field})
+# keep_default_na=False keeps every cell as the literal string, blanks included
+src = pd.read_csv(INPUT, dtype=str, keep_default_na=False)
+# per row, the first non-empty of perm / permutation / permuted
+perm_strs = pd.Series(None, index=src.index, dtype=object)
+for c in ("perm", "permutation", "permuted"):
+    if c in src.columns:
+        perm_strs = perm_strs.where(perm_strs.notna(), src[c].where(src[c] != ""))
+# fallback: take the second column value
+perm_strs = perm_strs.where(perm_strs.notna(), src.iloc[:, 1] if src.shape[1] >= 2 else "")
+orig_motifs = src["motif"] if "motif" in src.columns else pd.Series("", index=src.index)
+violated_masks = compute_violated_masks(parse_perms(perm_strs))
+
+# Stability over cover-check orders: the fraction of orders under which the first-violated label
+# matches the baseline, and the most common label. The classifier only reacts to violated covers,
+# so a uniformly random order of all covers reduces to a uniformly random order of the violated
+# ones, and enumerating those gives the exact values (at most 3! = 6 orders below the
+# GlobalDistortion cutoff, which decides 4+ violations regardless of order). The result depends
+# only on the violated mask, so it is computed once per distinct mask.
+def order_stability(violated, baseline_code):
+    if bin(violated).count("1") >= 4:
+        return 1.0, LABELS[baseline_code]
+    bits = [i for i in range(len(COVERS)) if violated >> i & 1]
+    codes = [classify_first_violated(violated, order) for order in itertools.permutations(bits)]
+    counts = [codes.count(code) for code in range(len(LABELS))]
+    return counts[baseline_code] / len(codes), LABELS[counts.index(max(counts))]
 
 perms = []
-random.seed(0)
-for i, r in enumerate(rows):
-    perm = parse_perm(r["perm_str"])
-    violated = compute_violated_covers_from_perm(perm)
-    baseline_order = COVERS.copy()
-    baseline_label = classify_first_violated(violated, baseline_order)
+stability_cache = {}
+for i, (orig_motif, perm_str, violated) in enumerate(zip(orig_motifs, perm_strs, violated_masks)):
+    baseline_order = list(range(len(COVERS)))
+    baseline_code = classify_first_violated(violated, baseline_order)
+    baseline_label = LABELS[baseline_code]
     any_label = classify_any_cover(violated)
 
-    # Stability sampling: randomize cover-check order N_RANDOM_ORDERS times
-    if not violated:
-        stability = 1.0
-        modal_label = baseline_label
-    else:
-        same_count = 0
-        modal_counts = Counter()
-        for _ in range(N_RANDOM_ORDERS):
-            order = COVERS.copy()
-            random.shuffle(order)
-            lab = classify_first_violated(violated, order)
-            modal_counts[lab] += 1
-            if lab == baseline_label:
-                same_count += 1
-        stability = same_count / N_RANDOM_ORDERS
-        modal_label = modal_counts.most_common(1)[0][0]
+    if violated not in stability_cache:
+        stability_cache[violated] = order_stability(violated, baseline_code)
+    stability, modal_label = stability_cache[violated]
 
     perms.append({
         "index": i,
-        "orig_motif": r["orig_motif"],
-        "perm_str": r["perm_str"],
-        "violated_covers": ";".join(f"({a},{b})" for a, b in sorted(violated)),
+        "orig_motif": orig_motif,
+        "perm_str": perm_str,
+        "violated_covers": ";".join(f"({a},{b})" for a, b in mask_to_covers(violated)),
         "baseline_first_label": baseline_label,
         "any_cover_label": any_label,
         "stability_fraction_first": stability,
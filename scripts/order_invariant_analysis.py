@@ -7,6 +7,7 @@
 import os, sys, csv, re
 from collections import Counter, defaultdict
 import pandas as pd
+from _covers import BRE_MASK, COVERS, EARLY_MASK, FRONT_MASK, LATE_MASK, compute_violated_masks, parse_perms
 
 # Input handling
 if len(sys.argv) > 1:
@@ -25,49 +26,26 @@ OUT_SUMMARY = "anycover_motif_summary.csv"
 OUT_CONFUSION = "orig_vs_anycover_confusion.csv"
 OUT_ADJ = "adjacency_any_occurrence_counts.csv"
 
-# Canonical covers used by mapping rules
-COVERS = [
-    (1,3),(1,4),(1,5),
-    (3,8),(4,8),(5,6),(6,7),(7,8),(8,9),
-    (9,10),(10,11),(11,12)
-]
-
-# Helper: parse permutation string like "6 8 3 10 ..." into list of ints
-def parse_perm(s):
-    if s is None:
-        return []
-    tokens = str(s).strip().split()
-    return [int(t) for t in tokens if t.strip().isdigit()]
-
-# Compute violated covers: a cover (a,b) is violated if a appears after b in the permutation
-def compute_violated_covers_from_perm(perm):
-    pos = {v:i for i,v in enumerate(perm)}
-    violated = []
-    for a,b in COVERS:
-        if a in pos and b in pos and pos[a] > pos[b]:
-            violated.append((a,b))
-    return set(violated)
+# Rendered cover strings, indexed by bit: "(a,b)" for violated_covers, "(a, b)" for adjacency keys
+COVER_STR_BY_BIT = [f"({a},{b})" for a,b in COVERS]
+ADJ_KEY_BY_BIT = [f"({a}, {b})" for a,b in COVERS]
 
 # Order-invariant classification (any-cover) with deterministic priority for ties
-def classify_any_cover(violated_set):
+def classify_any_cover(violated):
     # 1. GlobalDistortion — many violations (4 or more).
-    if len(violated_set) >= 4:
+    if bin(violated).count("1") >= 4:
         return "GlobalDistortion"
     # 2. FrontEndMove — violates any front covers (1,3), (1,4), (1,5).
-    front = {(1,3),(1,4),(1,5)}
-    if any(c in violated_set for c in front):
+    if violated & FRONT_MASK:
         return "FrontEndMove"
     # 3. BlockReorderExtreme — violates any block/chain covers among the set
-    bre_set = {(3,8),(4,8),(5,6),(6,7),(7,8),(8,9)}
-    if any(c in violated_set for c in bre_set):
+    if violated & BRE_MASK:
         return "BlockReorderExtreme"
     # 4. DualClusterOutlier — violates at least one early cover and at least one late cover
-    early = front
-    late = {(9,10),(10,11),(11,12)}
-    if any(c in violated_set for c in early) and any(c in violated_set for c in late):
+    if violated & EARLY_MASK and violated & LATE_MASK:
         return "DualClusterOutlier"
     # 5. AnchorPreservingDisorder — has violations but does not violate any front covers
-    if len(violated_set) > 0 and not any(c in violated_set for c in front):
+    if violated and not violated & FRONT_MASK:
         return "AnchorPreservingDisorder"
     # 6. Other
     return "Other"
@@ -90,16 +68,15 @@ if perm_col is None:
 orig_motif_col = "motif" if "motif" in df_src.columns else df_src.columns[0]
 
 # Compute violated covers and any-cover labels
+violated_masks = compute_violated_masks(parse_perms(df_src[perm_col]))
 rows_out = []
 adj_counts = Counter()
-for idx, row in df_src.iterrows():
+for (idx, row), violated in zip(df_src.iterrows(), violated_masks):
     perm_str = row[perm_col]
-    perm = parse_perm(perm_str)
-    violated = compute_violated_covers_from_perm(perm)
-    violated_str = ";".join(f"({a},{b})" for a,b in sorted(violated))
+    violated_bits = [i for i in range(len(COVERS)) if violated >> i & 1]
+    violated_str = ";".join([COVER_STR_BY_BIT[i] for i in violated_bits])
     # update adjacency counts
-    for a,b in violated:
-        adj_counts[f"({a}, {b})"] += 1
+    adj_counts.update([ADJ_KEY_BY_BIT[i] for i in violated_bits])
     any_label = classify_any_cover(violated)
     rows_out.append({
         "index": idx,
@@ -119,7 +96,9 @@ summary.columns = ["any_cover_label","count"]
 summary.to_csv(OUT_SUMMARY, index=False)
 
 # Confusion table: original motif vs any_cover_label
-conf = pd.crosstab(out_df["orig_motif"], out_df["any_cover_label"])
+# category dtype (categories sorted, as crosstab would) lets groupby count on integer codes
+conf_keys = out_df[["orig_motif","any_cover_label"]].astype("category")
+conf = conf_keys.groupby(["orig_motif","any_cover_label"], observed=True).size().unstack(fill_value=0)
 conf.to_csv(OUT_CONFUSION)
 
 # Adjacency any-occurrence counts
@@ -5,107 +5,231 @@ Run this script from the folder containing motif_stability_per_permutation.csv,
 ParseA/outputs/cluster_labels_parseA.csv, and ParseB/outputs/cluster_labels_parseB.csv.
 """
 import os
+import sys
+import numpy as np
 import pandas as pd
 
+# shared helpers live next to the other analysis scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from _bootstrap import write_parquet_copy
+
 ROOT = os.getcwd()
 CANON = os.path.join(ROOT, "motif_stability_per_permutation.csv")
 PARSEA = os.path.join(ROOT, "ParseA", "outputs", "cluster_labels_parseA.csv")
 PARSEB = os.path.join(ROOT, "ParseB", "outputs", "cluster_labels_parseB.csv")
 OUTDIR = os.path.join(ROOT, "outputs")
 os.makedirs(OUTDIR, exist_ok=True)
+PERM_CHUNK_ROWS = 200_000  # rows per slice when writing the permutation table
 
-def load_csv(path):
+def load_csv(path, usecols=None, nrows=None):
     if not os.path.exists(path):
         raise FileNotFoundError(f"Missing file: {path}")
-    return pd.read_csv(path)
-
-# Load files
-df_can = load_csv(CANON)
-df_a = load_csv(PARSEA)
-df_b = load_csv(PARSEB)
+    if nrows is None:
+        try:
+            return load_cached(path, usecols)
+        except ImportError:
+            pass
+    return pd.read_csv(path, usecols=usecols, nrows=nrows)
 
-# Normalize index column name to 'index'
-def find_index_col(df):
-    for c in df.columns:
-        if c.lower() in ('index','perm_index','perm','id'):
-            return c
+# Parquet cache (optional, needs pyarrow): the CSV stays the source of truth; a zstd
+# <file>.csv.parquet sibling is reused while it is at least as new as the CSV. A miss caches every
+# column, so later runs can read any column subset from it.
+def fresh_cache(path):
+    pq = path + '.parquet'
+    if os.path.exists(pq) and os.path.getmtime(pq) >= os.path.getmtime(path):
+        return pq
     return None
 
-idx_can = find_index_col(df_can)
+def load_cached(path, usecols=None):
+    # without pyarrow this raises ImportError before anything is read, and load_csv reads the CSV
+    import pyarrow.parquet
+    pq = fresh_cache(path)
+    if pq:
+        return pd.read_parquet(pq, engine='pyarrow', columns=usecols)
+    pq = path + '.parquet'
+    df = pd.read_csv(path)
+    try:
+        df.to_parquet(pq, engine='pyarrow', compression='zstd', index=False)
+    except (TypeError, ValueError, OSError):
+        # e.g. a mixed-type column or a read-only folder: skip caching, drop any partial file
+        if os.path.exists(pq):
+            os.remove(pq)
+    return df if usecols is None else df[usecols]
+
+# Columns are detected from each file's header (nrows=0) and only those are parsed. Detection is
+# one table-driven pass over (name, lowercased name) pairs: each column goes to the first rule,
+# in order, that is still unfilled and whose `names` equal or `keys` occur in the lowercased
+# name, so a column claimed by one rule is never reused by a later one.
+INDEX_NAMES = ('index','perm_index','perm','id')
+CAN_RULES = {
+    'index': (INDEX_NAMES, ()),
+    'label': ((), ('orig_motif','primary_label','modal_label','motif','label','cluster')),
+    'stability': ((), ('stability',)),
+}
+PARSE_RULES = {
+    'index': (INDEX_NAMES, ()),
+    'cluster': ((), ('cluster','label','primary_label','motif')),
+}
+
+def read_header(path):
+    # a fresh Parquet cache answers from its schema (footer metadata only) without opening the CSV
+    pq = fresh_cache(path) if os.path.exists(path) else None
+    try:
+        import pyarrow.parquet as papq
+        columns = papq.read_schema(pq).names if pq else None
+    except ImportError:
+        columns = None
+    if columns is None:
+        columns = load_csv(path, nrows=0).columns
+    return [(c, c.lower()) for c in columns]
+
+def detect(header, rules):
+    found = dict.fromkeys(rules)
+    for c, lc in header:
+        for rule, (names, keys) in rules.items():
+            if found[rule] is None and (lc in names or any(k in lc for k in keys)):
+                found[rule] = c
+                break
+    return found
+
+# Normalize index column name to 'index'
+can_header = read_header(CANON)
+can_found = detect(can_header, CAN_RULES)
+idx_can = can_found['index']
 if idx_can is None:
     raise SystemExit("Cannot find index column in canonical file.")
-df_can = df_can.rename(columns={idx_can: 'index'})
 
 # detect canonical label column and rename to 'primary_label_canonical'
-can_label = None
-for c in df_can.columns:
-    if any(k in c.lower() for k in ['orig_motif','primary_label','modal_label','motif','label','cluster']):
-        can_label = c
-        break
+can_label = can_found['label']
 if can_label is None:
     raise SystemExit("Cannot detect canonical label column.")
-df_can = df_can.rename(columns={can_label: 'primary_label_canonical'})
 
-# prepare parse files: rename index and cluster columns
-def prepare_parse(df):
-    idx = find_index_col(df)
+# optional stability fraction, carried to the output table
+stab_col = can_found['stability']
+can_cols = [c for c, _ in can_header if c in (idx_can, can_label, stab_col)]
+df_can = load_csv(CANON, usecols=can_cols)
+df_can = df_can.rename(columns={idx_can: 'index', can_label: 'primary_label_canonical'})
+# low-cardinality labels and clusters are categorical, so groupby and map work on integer codes
+df_can['primary_label_canonical'] = df_can['primary_label_canonical'].astype('category')
+
+# load parse files with only their index and cluster columns, renamed to 'index' and 'cluster'
+def prepare_parse(path):
+    header = read_header(path)
+    found = detect(header, PARSE_RULES)
+    idx, cluster_col = found['index'], found['cluster']
+    df = load_csv(path, usecols=[c for c, _ in header if c in (idx, cluster_col)])
     if idx:
         df = df.rename(columns={idx: 'index'})
-    cluster_col = None
-    for c in df.columns:
-        if any(k in c.lower() for k in ['cluster','label','primary_label','motif']) and c.lower() != 'index':
-            cluster_col = c
-            break
     if cluster_col:
         df = df.rename(columns={cluster_col: 'cluster'})
+        df['cluster'] = df['cluster'].astype('category')
     return df
 
-df_a = prepare_parse(df_a)
-df_b = prepare_parse(df_b)
+df_a = prepare_parse(PARSEA)
+df_b = prepare_parse(PARSEB)
+
+# Merge canonical with parse labels: one parse label per index (the first listed). Parse labels
+# are indexed and sorted by 'index' so the left joins align on a monotonic index; validate turns
+# a duplicated canonical index into an error instead of silently repeating rows.
+def parse_labels(df_parse, name):
+    labels = df_parse[['index','cluster']].set_index('index')
+    # files with one label per index (the normal case) skip the dedupe and, if already
+    # ordered, the sort; the index checks are cached on the Index and need no copy
+    if not labels.index.is_unique:
+        labels = labels[~labels.index.duplicated()]
+    if not labels.index.is_monotonic_increasing:
+        labels = labels.sort_index()
+    return labels.rename(columns={'cluster': name})
 
-# Merge canonical with parse labels
-df = df_can.copy()
+# the canonical frame is not used again, so its index is set in place: without copy-on-write
+# (pandas < 3) set_index() would otherwise copy every canonical column before the joins
+df_can.set_index('index', inplace=True)
+df = df_can
 if df_a is not None:
-    df = df.merge(df_a[['index','cluster']].drop_duplicates(), on='index', how='left').rename(columns={'cluster':'cluster_parseA'})
+    df = df.join(parse_labels(df_a, 'cluster_parseA'), how='left', validate='one_to_one')
 if df_b is not None:
-    df = df.merge(df_b[['index','cluster']].drop_duplicates(), on='index', how='left').rename(columns={'cluster':'cluster_parseB'})
+    df = df.join(parse_labels(df_b, 'cluster_parseB'), how='left', validate='one_to_one')
+df = df.reset_index()
 
 # Build majority-vote mapping cluster -> canonical motif
 def build_mapping(df, cluster_col):
     if cluster_col not in df.columns:
         return {}
-    mapping = {}
-    groups = df.dropna(subset=[cluster_col, 'primary_label_canonical']).groupby(cluster_col)
-    for cluster_val, g in groups:
-        top = g['primary_label_canonical'].value_counts().idxmax()
-        mapping[cluster_val] = top
-    return mapping
+    # majority vote on the categorical codes: a (cluster, label) count matrix from one bincount,
+    # argmax per cluster. Ties go to the label seen first within the cluster (first row of each
+    # pair), matching the old per-group value_counts().idxmax(); the first-row lookup (a sort)
+    # only runs when some cluster actually has tied top counts
+    cluster_codes = df[cluster_col].cat.codes.to_numpy()
+    label_codes = df['primary_label_canonical'].cat.codes.to_numpy()
+    valid = (cluster_codes >= 0) & (label_codes >= 0)
+    cluster_codes, label_codes = cluster_codes[valid].astype(np.int64), label_codes[valid].astype(np.int64)
+    if not valid.any():
+        return {}
+    cluster_cats = df[cluster_col].cat.categories
+    label_cats = df['primary_label_canonical'].cat.categories
+    n, n_labels = len(cluster_codes), len(label_cats)
+    pair = cluster_codes * n_labels + label_codes
+    counts = np.bincount(pair, minlength=len(cluster_cats) * n_labels).reshape(len(cluster_cats), n_labels)
+    top = counts.max(axis=1, keepdims=True)
+    observed = top[:, 0] > 0
+    if ((counts == top).sum(axis=1) > 1)[observed].any():
+        first = np.full(counts.size, n, dtype=np.int64)
+        seen, first_row = np.unique(pair, return_index=True)
+        first[seen] = first_row
+        best = np.argmax(counts * (n + 1) - first.reshape(counts.shape), axis=1)
+    else:
+        best = np.argmax(counts, axis=1)
+    return dict(zip(cluster_cats[observed], label_cats[best[observed]]))
 
 map_a = build_mapping(df, 'cluster_parseA')
 map_b = build_mapping(df, 'cluster_parseB')
 
-# Apply mapping to create relabeled parse columns
-df['parseA_mapped'] = df['cluster_parseA'].map(map_a)
-df['parseB_mapped'] = df['cluster_parseB'].map(map_b)
+# Apply mapping to create relabeled parse columns. The mapping is resolved once per cluster
+# category (rename_categories cannot be used: several clusters share a motif) and the rows are
+# relabeled by gathering through their codes; code -1 (missing or unmapped) stays NaN.
+def map_clusters(clusters, mapping, label_cats):
+    label_code = {lab: i for i, lab in enumerate(label_cats)}
+    cat_to_label = np.array([label_code.get(mapping.get(c), -1) for c in clusters.cat.categories] + [-1])
+    codes = cat_to_label[clusters.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=label_cats), index=clusters.index)
+
+label_cats = df['primary_label_canonical'].cat.categories
+df['parseA_mapped'] = map_clusters(df['cluster_parseA'], map_a, label_cats)
+df['parseB_mapped'] = map_clusters(df['cluster_parseB'], map_b, label_cats)
+
+# Outputs are written as CSV; with pyarrow available a zstd Parquet copy is written next to each
+# for downstream consumers (best effort, like the input cache). Rows are written in slices of
+# chunk_rows over the selected columns, so the full projection is never materialized at once.
+def iter_chunks(df, columns, chunk_rows):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield start, df.iloc[start:start + chunk_rows][columns]
+
+def write_output(df, name, columns=None, chunk_rows=None):
+    columns = list(df.columns) if columns is None else columns
+    chunk_rows = chunk_rows or max(len(df), 1)
+    path = os.path.join(OUTDIR, name)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for start, part in iter_chunks(df, columns, chunk_rows):
+            part.to_csv(f, header=(start == 0), index=False)
+    write_parquet_copy(df, path, columns=columns, chunk_rows=chunk_rows)
 
 # Select and write mapping CSVs
-map_a_df = pd.DataFrame(sorted(map_a.items()), columns=['cluster_parseA','mapped_motif'])
-map_b_df = pd.DataFrame(sorted(map_b.items()), columns=['cluster_parseB','mapped_motif'])
-map_a_df.to_csv(os.path.join(OUTDIR, "cluster_to_motif_mapping_parseA.csv"), index=False)
-map_b_df.to_csv(os.path.join(OUTDIR, "cluster_to_motif_mapping_parseB.csv"), index=False)
+# build_mapping yields clusters in category order, which astype('category') sorts, so the tables
+# come straight from the mapping Series with no re-sort of (cluster, motif) pairs
+def mapping_frame(mapping, cluster_col):
+    return pd.Series(mapping, name='mapped_motif', dtype=object).rename_axis(cluster_col).reset_index()
+
+map_a_df = mapping_frame(map_a, 'cluster_parseA')
+map_b_df = mapping_frame(map_b, 'cluster_parseB')
+write_output(map_a_df, "cluster_to_motif_mapping_parseA.csv")
+write_output(map_b_df, "cluster_to_motif_mapping_parseB.csv")
 
 # Prepare full per-permutation table and write
 cols_out = ['index','primary_label_canonical','cluster_parseA','parseA_mapped','cluster_parseB','parseB_mapped']
-# include stability fraction if present
-stab_col = None
-for c in df.columns:
-    if 'stability' in c.lower():
-        stab_col = c
-        break
+# include stability fraction if present (detected with the canonical header)
 if stab_col:
     cols_out.append(stab_col)
-permutation_table = df[cols_out]
-permutation_table.to_csv(os.path.join(OUTDIR, "permutation_label_table.csv"), index=False)
+write_output(df, "permutation_label_table.csv", columns=cols_out, chunk_rows=PERM_CHUNK_ROWS)
 
 print("Wrote:")
 print(" -", os.path.join(OUTDIR, "cluster_to_motif_mapping_parseA.csv"))